@@ -1,11 +1,10 @@
 import chess
 import chess.engine
 import chess.polyglot
-import threading
+import ctypes
+import multiprocessing
 import time
-import math
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
 
 # Constants for evaluation
 PIECE_VALUES = {
@@ -51,88 +50,408 @@ PIECE_SQUARE_TABLES = {
     # Add other piece-square tables for rook, queen, king...
 }
 
+# Per-color lookups built once; black reads the table mirrored across the ranks
+PST_WHITE = {pt: tuple(PIECE_SQUARE_TABLES.get(pt, [0] * 64)) for pt in chess.PIECE_TYPES}
+PST_BLACK = {pt: tuple(PST_WHITE[pt][sq ^ 56] for sq in chess.SQUARES) for pt in chess.PIECE_TYPES}
+
+# Search scores are ints so they can be packed into the transposition table
+INF = 1000000
+MATE_SCORE = 100000
+
+# Transposition table entry flags
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+MASK64 = (1 << 64) - 1
+
+# Killer moves are kept per remaining depth, up to this search depth
+MAX_DEPTH = 64
+
+# Depth reduction for the null-move search, on top of the usual one ply
+NULL_MOVE_REDUCTION = 2
+ASPIRATION_WINDOW = 50
+
+def mvv_lva(board, move):
+    """Scores a capture by most valuable victim, least valuable attacker."""
+    victim = board.piece_type_at(move.to_square) or chess.PAWN  # en passant lands on an empty square
+    attacker = board.piece_type_at(move.from_square)
+    return 10 * PIECE_VALUES[victim] - PIECE_VALUES[attacker]
+
+def has_non_pawn_material(board):
+    """Whether the side to move has a piece besides pawns and king; null moves are unsafe without one."""
+    return any(board.pieces_mask(piece_type, board.turn)
+               for piece_type in (chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN))
+
+def material_balance(board):
+    """Material plus piece-square score of the board from white's point of view."""
+    eval_score = 0
+    for piece_type in chess.PIECE_TYPES:
+        value = PIECE_VALUES[piece_type]
+        for color, pst, sign in ((chess.WHITE, PST_WHITE[piece_type], 1), (chess.BLACK, PST_BLACK[piece_type], -1)):
+            bb = board.pieces_mask(piece_type, color)
+            while bb:
+                eval_score += sign * (value + pst[(bb & -bb).bit_length() - 1])
+                bb &= bb - 1
+    return eval_score
+
+class Searcher:
+    """A board together with its white-relative material score, kept up to date move by move."""
+
+    def __init__(self, board):
+        self.board = board
+        self.eval_w = material_balance(board)
+        self.undo_stack = []
+
+    def do_move(self, move):
+        """Pushes a move and adds its material and piece-square change to eval_w."""
+        board = self.board
+        from_square, to_square = move.from_square, move.to_square
+        pst, their_pst = (PST_WHITE, PST_BLACK) if board.turn else (PST_BLACK, PST_WHITE)
+        piece_type = board.piece_type_at(from_square)
+
+        if move.promotion:
+            delta = (PIECE_VALUES[move.promotion] + pst[move.promotion][to_square]
+                     - PIECE_VALUES[piece_type] - pst[piece_type][from_square])
+        else:
+            delta = pst[piece_type][to_square] - pst[piece_type][from_square]
+
+        if piece_type == chess.KING and board.is_castling(move):
+            rank = chess.square_rank(from_square)
+            if chess.square_file(to_square) > chess.square_file(from_square):
+                rook_from, rook_to = chess.square(7, rank), chess.square(5, rank)
+            else:
+                rook_from, rook_to = chess.square(0, rank), chess.square(3, rank)
+            delta += pst[chess.ROOK][rook_to] - pst[chess.ROOK][rook_from]
+        elif piece_type == chess.PAWN and board.is_en_passant(move):
+            captured_square = chess.square(chess.square_file(to_square), chess.square_rank(from_square))
+            delta += PIECE_VALUES[chess.PAWN] + their_pst[chess.PAWN][captured_square]
+        else:
+            captured = board.piece_type_at(to_square)
+            if captured:
+                delta += PIECE_VALUES[captured] + their_pst[captured][to_square]
+
+        if not board.turn:
+            delta = -delta
+        board.push(move)
+        self.eval_w += delta
+        self.undo_stack.append(delta)
+
+    def undo_move(self):
+        """Pops the last move and takes its change back out of eval_w."""
+        self.board.pop()
+        self.eval_w -= self.undo_stack.pop()
+
+    def do_null_move(self):
+        """Passes the turn to the opponent; undo it with undo_move."""
+        self.board.push(chess.Move.null())
+        self.undo_stack.append(0)
+
+class TranspositionTable:
+    """Fixed-size transposition table in two flat 64-bit arrays, indexed by the low bits of the Zobrist hash.
+
+    Slots come in pairs: the first keeps the deepest entry of the current search, the second always
+    takes the newest one. Each entry packs value:22, depth:8, generation:16, flag:2 and best_move:16
+    into one int, and its key is stored XORed with that int, so a half-written entry fails validation
+    instead of being misread. The arrays and the generation counter live in shared memory so helper
+    processes can probe and store into the same table.
+    """
+
+    def __init__(self, size=1 << 22, shared=None):
+        if shared is None:
+            shared = (multiprocessing.RawArray("Q", size), multiprocessing.RawArray("q", size),
+                      multiprocessing.RawValue("H", 0))
+        self.shared = shared
+        self.mask = (len(shared[0]) - 1) & ~1
+        self.keys = memoryview(shared[0]).cast("B").cast("Q")
+        self.data = memoryview(shared[1]).cast("B").cast("q")
+        self.generation = shared[2]
+
+    def new_search(self):
+        """Starts a new search generation, so deep entries left by earlier searches become replaceable.
+
+        When the 16-bit counter wraps, the table is cleared so no stale entry can pass for a current one.
+        """
+        self.generation.value = (self.generation.value + 1) & 0xFFFF
+        if self.generation.value == 0:
+            for array in self.shared[:2]:
+                ctypes.memset(array, 0, ctypes.sizeof(array))
+
+    def probe(self, zhash):
+        """Returns (value, depth, flag, best_move) stored for the position, or None."""
+        index = zhash & self.mask
+        for slot in (index, index + 1):
+            data = self.data[slot]
+            if self.keys[slot] ^ (data & MASK64) == zhash:
+                move = data & 0xFFFF
+                best_move = chess.Move(move & 63, (move >> 6) & 63, (move >> 12) or None) if move else None
+                return data >> 42, (data >> 34) & 0xFF, (data >> 16) & 3, best_move
+        return None
+
+    def store(self, zhash, value, depth, flag, best_move):
+        """Stores an entry, replacing the deeper slot only with an entry at least as deep or from an older search."""
+        move = 0
+        if best_move:
+            move = best_move.from_square | (best_move.to_square << 6) | ((best_move.promotion or 0) << 12)
+        generation = self.generation.value
+        data = (value << 42) | (depth << 34) | (generation << 18) | (flag << 16) | move
+
+        slot = zhash & self.mask
+        old = self.data[slot]
+        if (depth < (old >> 34) & 0xFF and (old >> 18) & 0xFFFF == generation
+                and self.keys[slot] ^ (old & MASK64) != zhash):
+            slot += 1
+        self.keys[slot] = zhash ^ (data & MASK64)
+        self.data[slot] = data
+
+class SearchTimeout(Exception):
+    """Raised inside the search once the time budget for a move is spent or the search is stopped."""
+
 class AiymaChessZero:
-    def __init__(self, depth=10, threads=4):
+    def __init__(self, depth=10, threads=4, time_limit=None, book_path="book.bin", tt_size=1 << 22,
+                 transposition_table=None, verbose=False):
         self.depth = depth
         self.threads = threads
-        self.transposition_table = {}
-        self.lock = threading.Lock()
+        self.time_limit = time_limit
+        self.deadline = None
+        self.stop = multiprocessing.RawValue("b", 0)
+        self.pool = None
+        self.transposition_table = transposition_table or TranspositionTable(tt_size)
+        self.killers = [[None, None] for _ in range(MAX_DEPTH + 1)]
+        self.verbose = verbose
+        self.book = None
+        if book_path is not None:
+            try:
+                self.book = chess.polyglot.open_reader(book_path)
+            except FileNotFoundError:
+                pass
+
+    def evaluate_board(self, board, eval_w=None):
+        """Evaluates the board with material and positional heuristics for the side to move.
 
-    def evaluate_board(self, board):
-        """Evaluates the board with material and positional heuristics."""
+        eval_w is the white-relative score a Searcher keeps; without it the board is scanned.
+        Draws are not detected here; search_root checks them once per root move.
+        """
         if board.is_checkmate():
-            return -math.inf if board.turn else math.inf
-        if board.is_stalemate() or board.is_insufficient_material():
+            return -MATE_SCORE
+
+        if eval_w is None:
+            eval_w = material_balance(board)
+        return eval_w if board.turn == chess.WHITE else -eval_w
+
+    def order_moves(self, board, depth, tt_move=None):
+        """Orders moves: TT move, captures by MVV-LVA, promotions, killer moves, then quiet moves."""
+        killers = self.killers[depth]
+
+        def score(move):
+            if move == tt_move:
+                return 1000000000
+            if board.is_capture(move):
+                return 1000000 + mvv_lva(board, move)
+            if move.promotion:
+                return 500000
+            if move in killers:
+                return 100000
             return 0
 
-        eval_score = 0
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece:
-                value = PIECE_VALUES[piece.piece_type]
-                pst_value = PIECE_SQUARE_TABLES.get(piece.piece_type, [0] * 64)[square]
-                eval_score += (value + pst_value) if piece.color == board.turn else -(value + pst_value)
-        return eval_score
-
-    def minimax(self, board, depth, alpha, beta, maximizing_player):
-        """Minimax algorithm with alpha-beta pruning and multi-threading."""
-        with self.lock:
-            key = (board.fen(), depth)
-            if key in self.transposition_table:
-                return self.transposition_table[key]
-
-        if depth == 0 or board.is_game_over():
-            score = self.evaluate_board(board)
-            with self.lock:
-                self.transposition_table[key] = score
-            return score
-
-        legal_moves = list(board.legal_moves)
-        if maximizing_player:
-            max_eval = -math.inf
-            for move in legal_moves:
-                board.push(move)
-                eval = self.minimax(board, depth - 1, alpha, beta, False)
-                board.pop()
-                max_eval = max(max_eval, eval)
-                alpha = max(alpha, eval)
-                if beta <= alpha:
-                    break
-            with self.lock:
-                self.transposition_table[key] = max_eval
-            return max_eval
+        return sorted(board.legal_moves, key=score, reverse=True)
+
+    def store_killer(self, move, depth):
+        """Remembers a quiet move that caused a beta cutoff at this depth."""
+        killers = self.killers[depth]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    def qsearch(self, searcher, alpha, beta):
+        """Quiescence search: keeps playing captures from a leaf until the position is quiet."""
+        board = searcher.board
+        stand_pat = self.evaluate_board(board, searcher.eval_w)
+        if stand_pat >= beta:
+            return beta
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = sorted(board.generate_legal_captures(), key=lambda move: mvv_lva(board, move), reverse=True)
+        for move in captures:
+            searcher.do_move(move)
+            score = -self.qsearch(searcher, -beta, -alpha)
+            searcher.undo_move()
+            if score >= beta:
+                return beta
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def minimax(self, searcher, depth, alpha, beta):
+        """Negamax search with alpha-beta pruning, scored for the side to move."""
+        board = searcher.board
+        if self.stop.value or (self.deadline is not None and time.time() >= self.deadline):
+            raise SearchTimeout
+
+        alpha_orig = alpha
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self.transposition_table.probe(key)
+        tt_move = entry[3] if entry is not None else None
+        if entry is not None and entry[1] >= depth:
+            value, _, flag, _ = entry
+            if flag == EXACT:
+                return value
+            elif flag == LOWER_BOUND:
+                if value > alpha:
+                    alpha = value
+            elif flag == UPPER_BOUND:
+                if value < beta:
+                    beta = value
+            if alpha >= beta:
+                return value
+
+        if depth == 0:
+            return self.qsearch(searcher, alpha, beta)
+
+        # Null move: if passing still fails high, a real move would too. Never pass twice in a row.
+        after_null_move = bool(board.move_stack) and not board.move_stack[-1]
+        if (depth >= 3 and beta < INF and not after_null_move
+                and not board.is_check() and has_non_pawn_material(board)):
+            searcher.do_null_move()
+            eval = -self.minimax(searcher, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1)
+            searcher.undo_move()
+            if eval >= beta:
+                return beta
+
+        best_eval = -INF
+        best_move = None
+        for i, move in enumerate(self.order_moves(board, depth, tt_move)):
+            quiet = not board.is_capture(move) and move.promotion is None
+            searcher.do_move(move)
+            # Late move reductions: late quiet moves get a reduced null-window search first,
+            # and a full-depth re-search only if they beat alpha
+            if i >= 4 and depth >= 3 and quiet and not board.is_check():
+                reduction = 1 + (i >= 8)
+                eval = -self.minimax(searcher, depth - 1 - reduction, -alpha - 1, -alpha)
+                if eval > alpha:
+                    eval = -self.minimax(searcher, depth - 1, -beta, -alpha)
+            else:
+                eval = -self.minimax(searcher, depth - 1, -beta, -alpha)
+            searcher.undo_move()
+            if eval > best_eval:
+                best_eval = eval
+                best_move = move
+            if eval > alpha:
+                alpha = eval
+            if alpha >= beta:
+                if quiet:
+                    self.store_killer(move, depth)
+                break
+
+        if best_move is None:
+            # No legal moves: mated or stalemated
+            best_eval = -MATE_SCORE if board.is_check() else 0
+            self.transposition_table.store(key, best_eval, depth, EXACT, None)
+            return best_eval
+
+        if best_eval <= alpha_orig:
+            flag = UPPER_BOUND
+        elif best_eval >= beta:
+            flag = LOWER_BOUND
         else:
-            min_eval = math.inf
-            for move in legal_moves:
-                board.push(move)
-                eval = self.minimax(board, depth - 1, alpha, beta, True)
-                board.pop()
-                min_eval = min(min_eval, eval)
-                beta = min(beta, eval)
-                if beta <= alpha:
-                    break
-            with self.lock:
-                self.transposition_table[key] = min_eval
-            return min_eval
+            flag = EXACT
+        self.transposition_table.store(key, best_eval, depth, flag, best_move)
+        return best_eval
 
-    def get_best_move(self, board):
-        """Gets the best move by searching the tree with multi-threading."""
+    def search_root(self, searcher, depth, pv_move=None, alpha=-INF, beta=INF):
+        """Searches every root move inside (alpha, beta) to the given depth, trying the previous best move first."""
+        board = searcher.board
+        alpha_orig = alpha
         best_move = None
-        best_eval = -math.inf
-        with ThreadPoolExecutor(max_workers=self.threads) as executor:
-            futures = []
-            for move in board.legal_moves:
-                board.push(move)
-                future = executor.submit(self.minimax, board, self.depth - 1, -math.inf, math.inf, False)
-                futures.append((move, future))
-                board.pop()
-            for move, future in futures:
-                eval = future.result()
-                if eval > best_eval:
-                    best_eval = eval
-                    best_move = move
+        best_eval = -INF
+        for move in self.order_moves(board, depth, pv_move):
+            searcher.do_move(move)
+            if board.is_stalemate() or board.is_insufficient_material() or board.can_claim_draw():
+                eval = 0
+            else:
+                eval = -self.minimax(searcher, depth - 1, -beta, -alpha)
+            searcher.undo_move()
+            if eval > best_eval or best_move is None:
+                best_eval = eval
+                best_move = move
+            if eval > alpha:
+                alpha = eval
+            if alpha >= beta or best_eval >= MATE_SCORE:
+                break  # Fail high, or nothing beats a mate
+        if best_eval <= alpha_orig:
+            flag = UPPER_BOUND
+        elif best_eval >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.transposition_table.store(chess.polyglot.zobrist_hash(board), best_eval, depth, flag, best_move)
+        return best_eval, best_move
+
+    def _root_id_search(self, board, depth_offset):
+        """Iterative deepening on one board copy; returns the last completed iteration's move.
+
+        From depth 3 on, each iteration searches a narrow window around the previous score and widens it on a fail.
+        """
+        searcher = Searcher(board)
+        best_move = next(iter(board.legal_moves), None)
+        score = 0
+        for depth in range(1 + depth_offset, self.depth + 1):
+            delta = ASPIRATION_WINDOW
+            if depth <= 2:
+                alpha, beta = -INF, INF
+            else:
+                alpha, beta = score - delta, score + delta
+            try:
+                while True:
+                    score, move = self.search_root(searcher, depth, best_move, alpha, beta)
+                    if score <= alpha:
+                        alpha -= 2 * delta
+                    elif score >= beta:
+                        beta += 2 * delta
+                        best_move = move  # A fail-high move is still better than last iteration's
+                    else:
+                        break
+                    delta *= 2
+            except SearchTimeout:
+                break
+            best_move = move
         return best_move
 
+    def get_best_move(self, board):
+        """Gets the best move from the opening book, else with lazy SMP: helper processes search the same root and share the TT."""
+        if self.book is not None:
+            try:
+                return self.book.weighted_choice(board).move
+            except IndexError:
+                pass
+
+        self.deadline = time.time() + self.time_limit if self.time_limit is not None else None
+        self.stop.value = 0
+        self.transposition_table.new_search()
+        if self.threads > 1 and self.pool is None:
+            self.pool = multiprocessing.Pool(self.threads - 1, initializer=_init_helper,
+                                             initargs=(self.transposition_table.shared, self.stop))
+        helpers = [self.pool.apply_async(_helper_search, (board, self.depth, depth_offset, self.deadline))
+                   for depth_offset in range(1, self.threads)]
+
+        best_move = self._root_id_search(board.copy(), 0)
+
+        self.stop.value = 1
+        for helper in helpers:
+            helper.get()
+        self.deadline = None
+        return best_move
+
+    def close(self):
+        """Shuts down the helper processes, if any were started, and closes the opening book."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+
     def play_game(self):
         """Plays a full game as White."""
         board = chess.Board()
@@ -143,12 +462,32 @@ class AiymaChessZero:
             else:
                 # Opponent plays random move; replace with user input for interactive play.
                 board.push(next(iter(board.legal_moves)))
-            print(board)
-            print("\nEvaluation:", self.evaluate_board(board))
-            time.sleep(1)
+            # Log the board once every 5 full moves, after White's move
+            if self.verbose and board.fullmove_number % 5 == 0 and not board.turn:
+                print(board)
+                print("\nEvaluation:", self.evaluate_board(board))
         print("Game Over:", board.result())
 
+# Lazy SMP helper processes each keep one engine that shares the main engine's TT and stop flag
+_helper_engine = None
+
+def _init_helper(shared_tt, stop):
+    """Pool initializer: builds this helper process's engine on the shared TT."""
+    global _helper_engine
+    _helper_engine = AiymaChessZero(threads=1, book_path=None,
+                                    transposition_table=TranspositionTable(shared=shared_tt))
+    _helper_engine.stop = stop
+
+def _helper_search(board, depth, depth_offset, deadline):
+    """Runs iterative deepening on the root; only the TT entries it leaves behind are used."""
+    _helper_engine.depth = depth
+    _helper_engine.deadline = deadline
+    _helper_engine._root_id_search(board, depth_offset)
+
 # Usage Example
 if __name__ == "__main__":
     engine = AiymaChessZero(depth=10, threads=4)
-    engine.play_game()
+    try:
+        engine.play_game()
+    finally:
+        engine.close()
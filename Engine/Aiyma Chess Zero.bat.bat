@@ -1,6 +1,14 @@
-import math
 import sys
-import copy
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Run the search as plain Python when Numba is not installed
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
 
 # Piece values and basic positional bonuses
 PIECE_VALUES = {
@@ -8,117 +16,268 @@ PIECE_VALUES = {
     'p': -100, 'n': -320, 'b': -330, 'r': -500, 'q': -900, 'k': -20000
 }
 
+MAX_DEPTH = 64
+MAX_MOVES = 256
+
+# Search scores are plain ints so they can live inside Numba code and the TT
+INF = 1000000
+MATE_SCORE = 100000
+
+# Transposition table entry flags
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+TT_SIZE = 1 << 20
+
+# Flat board encoding: one int8 character code per square, sq = row * 8 + col
+EMPTY = ord(".")
+WHITE_PAWN = ord("P")
+BLACK_PAWN = ord("p")
+UPPER_A = ord("A")
+UPPER_Z = ord("Z")
+
+PIECE_VALUE_ARR = np.zeros(128, dtype=np.int64)
+for _piece, _value in PIECE_VALUES.items():
+    PIECE_VALUE_ARR[ord(_piece)] = _value
+
+# UCI square names indexed by sq, and the (row, col) position for each name
+SQUARE_NAMES = [chr(ord("a") + col) + str(8 - row) for row in range(8) for col in range(8)]
+SQUARE_POSITIONS = {name: divmod(sq, 8) for sq, name in enumerate(SQUARE_NAMES)}
+
+_rng = np.random.default_rng(20240101)
+ZOBRIST_PIECES = _rng.integers(-2**63, 2**63 - 1, size=(128, 64), dtype=np.int64)
+ZOBRIST_PIECES[EMPTY] = 0
+ZOBRIST_BLACK_TO_MOVE = _rng.integers(-2**63, 2**63 - 1, dtype=np.int64)
+
+
+# Moves are packed into one int32: from | to << 6 | promotion << 12 | captured << 16
+@njit(cache=True)
+def encode_move(frm, to, promotion, captured):
+    return frm | (to << 6) | (promotion << 12) | (captured << 16)
+
+
+@njit(cache=True)
+def is_white_piece(piece):
+    return UPPER_A <= piece <= UPPER_Z
+
+
+@njit(cache=True)
+def hash_board(board_arr, white_to_move):
+    """Zobrist hash of the flat board."""
+    h = 0
+    for sq in range(64):
+        h ^= ZOBRIST_PIECES[board_arr[sq], sq]
+    if not white_to_move:
+        h ^= ZOBRIST_BLACK_TO_MOVE
+    return h
+
+
+@njit(cache=True)
+def evaluate_array(board_arr, white_to_move):
+    """Material balance of the flat board for the side to move."""
+    score = 0
+    for sq in range(64):
+        score += PIECE_VALUE_ARR[board_arr[sq]]
+    return score if white_to_move else -score
+
+
+@njit(cache=True)
+def generate_moves(board_arr, white_to_move, moves):
+    """Fill moves with encoded moves for the side to move and return how many there are."""
+    n = 0
+    for sq in range(64):
+        piece = board_arr[sq]
+        if piece == EMPTY or is_white_piece(piece) != white_to_move:
+            continue
+        if piece == WHITE_PAWN or piece == BLACK_PAWN:
+            step = -8 if white_to_move else 8
+            start_row = 6 if white_to_move else 1
+            to = sq + step
+            if 0 <= to < 64 and board_arr[to] == EMPTY:
+                moves[n] = encode_move(sq, to, 0, EMPTY)
+                n += 1
+                if sq // 8 == start_row and board_arr[to + step] == EMPTY:
+                    moves[n] = encode_move(sq, to + step, 0, EMPTY)
+                    n += 1
+        # Add other piece moves (Rook, Knight, Bishop, Queen, King)...
+    return n
+
+
+@njit(cache=True)
+def make_move(board_arr, move):
+    frm = move & 63
+    to = (move >> 6) & 63
+    board_arr[to] = board_arr[frm]
+    board_arr[frm] = EMPTY
+
+
+@njit(cache=True)
+def unmake_move(board_arr, move):
+    frm = move & 63
+    to = (move >> 6) & 63
+    board_arr[frm] = board_arr[to]
+    board_arr[to] = (move >> 16) & 127
+
+
+@njit(cache=True)
+def score_moves(board_arr, moves, n, tt_move, killers, depth, scores):
+    """Ordering scores: TT move, captures by MVV-LVA, killer moves, then quiet moves."""
+    for i in range(n):
+        move = moves[i]
+        captured = (move >> 16) & 127
+        if move == tt_move:
+            scores[i] = 1000000000
+        elif captured != EMPTY:
+            attacker = board_arr[move & 63]
+            scores[i] = 1000000 + 10 * abs(PIECE_VALUE_ARR[captured]) - abs(PIECE_VALUE_ARR[attacker])
+        elif move == killers[depth, 0] or move == killers[depth, 1]:
+            scores[i] = 100000
+        else:
+            scores[i] = 0
+
+
+@njit(cache=True)
+def pick_move(moves, scores, start, n):
+    """Swap the best-scored remaining move into position start."""
+    best = start
+    for i in range(start + 1, n):
+        if scores[i] > scores[best]:
+            best = i
+    moves[start], moves[best] = moves[best], moves[start]
+    scores[start], scores[best] = scores[best], scores[start]
+    return moves[start]
+
+
+@njit(cache=True)
+def negamax(board_arr, white_to_move, alpha, beta, depth, h, tt_keys, tt_vals, killers):
+    """Negamax alpha-beta over the flat board, scored for the side to move."""
+    alpha_orig = alpha
+    index = h & (TT_SIZE - 1)
+    tt_move = 0
+    if tt_keys[index] == h:
+        data = tt_vals[index]
+        tt_move = (data >> 16) & 0xFFFFFF
+        if ((data >> 8) & 0xFF) >= depth:
+            value = data >> 40
+            flag = data & 0xFF
+            if flag == EXACT:
+                return value
+            elif flag == LOWER_BOUND:
+                if value > alpha:
+                    alpha = value
+            elif flag == UPPER_BOUND:
+                if value < beta:
+                    beta = value
+            if alpha >= beta:
+                return value
+
+    if depth == 0:
+        return evaluate_array(board_arr, white_to_move)
+
+    moves = np.empty(MAX_MOVES, dtype=np.int32)
+    n = generate_moves(board_arr, white_to_move, moves)
+    if n == 0:
+        return -MATE_SCORE
+
+    scores = np.empty(n, dtype=np.int64)
+    score_moves(board_arr, moves, n, tt_move, killers, depth, scores)
+
+    best_eval = -INF
+    best_move = 0
+    for i in range(n):
+        move = pick_move(moves, scores, i, n)
+        frm = move & 63
+        to = (move >> 6) & 63
+        piece = board_arr[frm]
+        captured = (move >> 16) & 127
+        child_h = (h ^ ZOBRIST_PIECES[piece, frm] ^ ZOBRIST_PIECES[piece, to]
+                   ^ ZOBRIST_PIECES[captured, to] ^ ZOBRIST_BLACK_TO_MOVE)
+        make_move(board_arr, move)
+        eval = -negamax(board_arr, not white_to_move, -beta, -alpha, depth - 1, child_h, tt_keys, tt_vals, killers)
+        unmake_move(board_arr, move)
+        if eval > best_eval:
+            best_eval = eval
+            best_move = move
+        if eval > alpha:
+            alpha = eval
+        if alpha >= beta:
+            if captured == EMPTY and move != killers[depth, 0]:
+                killers[depth, 1] = killers[depth, 0]
+                killers[depth, 0] = move
+            break
+
+    if best_eval <= alpha_orig:
+        flag = UPPER_BOUND
+    elif best_eval >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    tt_keys[index] = h
+    tt_vals[index] = (best_eval << 40) | (np.int64(best_move) << 16) | (depth << 8) | flag
+    return best_eval
+
 class ChessEngine:
     def __init__(self):
-        self.board = [
-            ["r", "n", "b", "q", "k", "b", "n", "r"],
-            ["p", "p", "p", "p", "p", "p", "p", "p"],
-            [".", ".", ".", ".", ".", ".", ".", "."],
-            [".", ".", ".", ".", ".", ".", ".", "."],
-            [".", ".", ".", ".", ".", ".", ".", "."],
-            [".", ".", ".", ".", ".", ".", ".", "."],
-            ["P", "P", "P", "P", "P", "P", "P", "P"],
-            ["R", "N", "B", "Q", "K", "B", "N", "R"]
-        ]
+        self.board = bytearray(b"rnbqkbnr" + b"pppppppp" + b"." * 32 + b"PPPPPPPP" + b"RNBQKBNR")
         self.white_to_move = True
+        self.killers = np.zeros((MAX_DEPTH, 2), dtype=np.int32)
+        self.tt_keys = np.zeros(TT_SIZE, dtype=np.int64)
+        self.tt_vals = np.zeros(TT_SIZE, dtype=np.int64)
 
     def evaluate(self):
         """Evaluate the board position."""
-        score = 0
-        for row in self.board:
-            for piece in row:
-                score += PIECE_VALUES.get(piece, 0)
-        return score
-
-    def generate_legal_moves(self):
-        """Generate all legal moves (simplified for now)."""
-        moves = []
-        for r, row in enumerate(self.board):
-            for c, piece in enumerate(row):
-                if piece.isupper() == self.white_to_move and piece != '.':
-                    moves.extend(self.generate_piece_moves((r, c), piece))
-        return moves
-
-    def generate_piece_moves(self, pos, piece):
-        """Generate moves for a single piece."""
-        directions = []
-        r, c = pos
-        moves = []
-
-        if piece.upper() == 'P':  # Pawn moves
-            step = -1 if piece.isupper() else 1
-            start_row = 6 if piece.isupper() else 1
-            if self.board[r + step][c] == ".":
-                moves.append(((r, c), (r + step, c)))
-                if r == start_row and self.board[r + 2 * step][c] == ".":
-                    moves.append(((r, c), (r + 2 * step, c)))
-        # Add other piece moves (Rook, Knight, Bishop, Queen, King)...
-
-        return moves
+        return int(evaluate_array(self.to_array(), True))
 
     def make_move(self, move):
-        """Execute a move on the board."""
+        """Execute a move on the board and return the captured piece code for undo_move."""
         from_pos, to_pos = move
-        self.board[to_pos[0]][to_pos[1]] = self.board[from_pos[0]][from_pos[1]]
-        self.board[from_pos[0]][from_pos[1]] = "."
+        frm = from_pos[0] * 8 + from_pos[1]
+        to = to_pos[0] * 8 + to_pos[1]
+        piece = self.board[frm]
+        captured_piece = self.board[to]
+        self.board[to] = piece
+        self.board[frm] = EMPTY
         self.white_to_move = not self.white_to_move
+        return captured_piece
 
     def undo_move(self, move, captured_piece):
         """Undo a move on the board."""
         from_pos, to_pos = move
-        self.board[from_pos[0]][from_pos[1]] = self.board[to_pos[0]][to_pos[1]]
-        self.board[to_pos[0]][to_pos[1]] = captured_piece
+        frm = from_pos[0] * 8 + from_pos[1]
+        to = to_pos[0] * 8 + to_pos[1]
+        self.board[frm] = self.board[to]
+        self.board[to] = captured_piece
         self.white_to_move = not self.white_to_move
 
-    def alpha_beta(self, depth, alpha, beta, maximizing_player):
-        """Alpha-Beta pruning with depth control."""
-        if depth == 0:
-            return self.evaluate(), None
-
-        legal_moves = self.generate_legal_moves()
-        if not legal_moves:
-            return -math.inf if maximizing_player else math.inf, None
-
-        best_move = None
-
-        if maximizing_player:
-            max_eval = -math.inf
-            for move in legal_moves:
-                captured_piece = self.board[move[1][0]][move[1][1]]
-                self.make_move(move)
-                eval, _ = self.alpha_beta(depth - 1, alpha, beta, False)
-                self.undo_move(move, captured_piece)
-                if eval > max_eval:
-                    max_eval = eval
-                    best_move = move
-                alpha = max(alpha, eval)
-                if beta <= alpha:
-                    break
-            return max_eval, best_move
-        else:
-            min_eval = math.inf
-            for move in legal_moves:
-                captured_piece = self.board[move[1][0]][move[1][1]]
-                self.make_move(move)
-                eval, _ = self.alpha_beta(depth - 1, alpha, beta, True)
-                self.undo_move(move, captured_piece)
-                if eval < min_eval:
-                    min_eval = eval
-                    best_move = move
-                beta = min(beta, eval)
-                if beta <= alpha:
-                    break
-            return min_eval, best_move
+    def to_array(self):
+        """Copy the board into an int8 array of piece character codes for the compiled search."""
+        return np.frombuffer(self.board, dtype=np.int8).copy()
+
+    def alpha_beta(self, depth, alpha=-INF, beta=INF):
+        """Negamax alpha-beta search for the side to move; returns (score, best move)."""
+        board_arr = self.to_array()
+        h = hash_board(board_arr, self.white_to_move)
+        score = int(negamax(board_arr, self.white_to_move, alpha, beta, depth, h,
+                            self.tt_keys, self.tt_vals, self.killers))
+
+        index = h & (TT_SIZE - 1)
+        move = int(self.tt_vals[index] >> 16) & 0xFFFFFF if self.tt_keys[index] == h else 0
+        if not move:
+            return score, None
+        frm, to = move & 63, (move >> 6) & 63
+        return score, ((frm // 8, frm % 8), (to // 8, to % 8))
 
     def get_best_move(self, depth):
         """Get the best move for the current position."""
-        _, best_move = self.alpha_beta(depth, -math.inf, math.inf, True)
+        _, best_move = self.alpha_beta(depth)
         return best_move
 
 
 class UCIEngine:
     def __init__(self):
         self.engine = ChessEngine()
+        self.last_moves = []
+        self.captured_pieces = []
         self.running = True
 
     def send(self, message):
@@ -144,14 +303,22 @@ class UCIEngine:
             pass  # Initialize for a new game if needed
 
     def handle_position(self, command):
-        """Handle the position command."""
+        """Handle the position command, only replaying moves that differ from the last position."""
         parts = command.split(" ")
         if "startpos" in parts:
-            self.engine = ChessEngine()  # Reset to start position
             moves_index = parts.index("moves") + 1 if "moves" in parts else len(parts)
             moves = parts[moves_index:]
-            for move in moves:
-                self.engine.make_move(self.uci_to_move(move))
+
+            common = 0
+            for old_move, new_move in zip(self.last_moves, moves):
+                if old_move != new_move:
+                    break
+                common += 1
+            while len(self.last_moves) > common:
+                self.engine.undo_move(self.uci_to_move(self.last_moves.pop()), self.captured_pieces.pop())
+            for move in moves[common:]:
+                self.captured_pieces.append(self.engine.make_move(self.uci_to_move(move)))
+                self.last_moves.append(move)
 
     def handle_go(self, command):
         """Handle the go command."""
@@ -161,13 +328,12 @@ class UCIEngine:
 
     def uci_to_move(self, move_str):
         """Convert UCI move string to internal move format."""
-        return ((8 - int(move_str[1]), ord(move_str[0]) - ord('a')),
-                (8 - int(move_str[3]), ord(move_str[2]) - ord('a')))
+        return SQUARE_POSITIONS[move_str[0:2]], SQUARE_POSITIONS[move_str[2:4]]
 
     def move_to_uci(self, move):
         """Convert internal move format to UCI move string."""
         from_pos, to_pos = move
-        return f"{chr(from_pos[1] + ord('a'))}{8 - from_pos[0]}{chr(to_pos[1] + ord('a'))}{8 - to_pos[0]}"
+        return SQUARE_NAMES[from_pos[0] * 8 + from_pos[1]] + SQUARE_NAMES[to_pos[0] * 8 + to_pos[1]]
 
     def run(self):
         """Main loop for the UCI protocol."""